@@ -1,16 +1,42 @@
-from dotenv import load_dotenv
-load_dotenv()
+import time
+_BOOT_T0 = time.perf_counter()
+
+from contextlib import contextmanager
+
+# -------------------------------------------------
+# STARTUP TIMING
+# -------------------------------------------------
+# Milliseconds spent per component during boot, printed at startup and served on /startup
+STARTUP_REPORT = {}
+
+@contextmanager
+def timed(component):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_REPORT[component] = round((time.perf_counter() - t0) * 1000, 1)
+
+with timed("import_dotenv"):
+    from dotenv import load_dotenv
+    load_dotenv()
 
 import os
-import time
+import re
+import socket
 import threading
-import requests
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
-from pesepay import Pesepay  #
 
-import re
-import db_manager
+with timed("import_requests"):
+    import requests
+with timed("import_fastapi"):
+    from fastapi import FastAPI, Request, HTTPException
+    from fastapi.responses import JSONResponse
+with timed("import_db_manager"):  # includes mysql.connector
+    import db_manager
+with timed("import_media_cache"):
+    import media_cache
+
+STARTUP_REPORT["imports"] = round((time.perf_counter() - _BOOT_T0) * 1000, 1)
 
 # -------------------------------------------------
 # APP & CONFIG
@@ -29,18 +55,41 @@ ENCRYPTION_KEY = os.getenv("PESEPAY_ENCRYPTION_KEY")
 RETURN_URL = os.getenv("PAYNOW_RETURN_URL")
 RESULT_URL = os.getenv("PAYNOW_RESULT_URL")
 
+# LAZY_INIT=1 (default): after the schema check, serve immediately and build the
+# PesePay client in the background. LAZY_INIT=0: build it before serving.
+LAZY_INIT = os.getenv("LAZY_INIT", "1") == "1"
 
+# Background jobs normally run in worker.py; set EMBEDDED_POLLER=1 to also run them inside web processes
+EMBEDDED_POLLER = os.getenv("EMBEDDED_POLLER", "0") == "1"
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
 
-integration_key = INTEGRATION_KEY.strip()
-encryption_key = ENCRYPTION_KEY.strip()
-
-# Convert hex string to bytes (AES expects 16, 24, or 32 bytes)
-aes_key_bytes = bytes.fromhex(encryption_key)  # 16 bytes
-
-# Initialize PesePay SDK
-pesepay = Pesepay(INTEGRATION_KEY, ENCRYPTION_KEY)
-pesepay.return_url = RETURN_URL
-pesepay.result_url = RESULT_URL
+# -------------------------------------------------
+# PESEPAY CLIENT (built on first use)
+# -------------------------------------------------
+_pesepay = None
+_pesepay_lock = threading.Lock()
+
+def get_pesepay():
+    global _pesepay
+    if _pesepay:
+        return _pesepay
+    with _pesepay_lock:
+        if not _pesepay:
+            with timed("pesepay_import"):
+                from pesepay import Pesepay
+
+            with timed("pesepay_client"):
+                integration_key = INTEGRATION_KEY.strip()
+                encryption_key = ENCRYPTION_KEY.strip()
+
+                # Validate the hex key up front (AES expects 16, 24, or 32 bytes)
+                bytes.fromhex(encryption_key)
+
+                client = Pesepay(integration_key, encryption_key)
+                client.return_url = RETURN_URL
+                client.result_url = RESULT_URL
+            _pesepay = client
+    return _pesepay
 
 # -------------------------------------------------
 # WHATSAPP UTILS
@@ -82,9 +131,23 @@ def send_whatsapp_message(phone: str, text: str):
     except Exception as e:
         print("WhatsApp send error:", e)
 
+def send_whatsapp_bulk(phones, text: str):
+    """Sends the same text to many chats over one keep-alive HTTP session."""
+    url = f"{GREEN_API_URL}/waInstance{ID_INSTANCE}/sendMessage/{API_TOKEN_INSTANCE}"
+    with requests.Session() as session:
+        for phone in phones:
+            try:
+                session.post(url, json={"chatId": f"{phone}@c.us", "message": text}, timeout=10)
+            except Exception as e:
+                print("WhatsApp bulk send error:", e)
+
 
 def process_successful_payment(uid, reference):
-    db_manager.mark_payment_paid(reference)
+    # The poller and the STATUS command can both get here for the same payment;
+    # only the caller that wins the claim delivers matches.
+    if not db_manager.claim_payment(reference):
+        return False
+
     db_manager.activate_user(uid)
     phone = db_manager.get_user_phone(uid)
     matches = db_manager.get_matches(uid)
@@ -98,42 +161,111 @@ def process_successful_payment(uid, reference):
                    f"📞 *Contact:* {m['contact_phone']}")
         
         if m.get('picture'):
-            send_whatsapp_image(phone, m['picture'], caption)
+            send_whatsapp_image(phone, media_cache.photo_url(m['picture'], m.get('picture_hash')), caption)
         else:
             send_whatsapp_message(phone, caption)
     
+    db_manager.mark_payment_paid(reference)
     db_manager.reset_user_payment(uid)
     db_manager.set_state(uid, "NEW")
+    return True
 
 # -------------------------------------------------
 # PAYMENT POLLING (Background Worker)
 # -------------------------------------------------
+PAYMENT_TIMEOUT = 60  # seconds a user has to approve the prompt
+
 def check_pending_payments():
     while True:
         try:
-            pending = db_manager.get_pending_payments()
-            now = time.time()
+            # 60 Second Timeout logic: one set-based pass, then a single bulk notification
+            expired_phones = db_manager.expire_stale_payments(PAYMENT_TIMEOUT, WORKER_ID)
+            if expired_phones:
+                send_whatsapp_bulk(expired_phones,
+                                   "❌ *Payment Failed!* You took more than 1 minute to pay. Type *HELLO* to try again.")
+
+            # Only the rows leased to this worker, so parallel pollers never share a payment
+            pending = db_manager.claim_pending_payments(WORKER_ID)
             for p in pending:
-                # 60 Second Timeout logic
-                if (now - p['created_at'].timestamp()) > 60:
-                    db_manager.set_state(p['user_id'], "NEW")
-                    db_manager.mark_payment_paid(p['reference'])
-                    send_whatsapp_message(db_manager.get_user_phone(p['user_id']), 
-                                          "❌ *Payment Failed!* You took more than 1 minute to pay. Type *HELLO* to try again.")
+                # Fresh lease per row; skip rows another worker took over while earlier ones ran long
+                if not db_manager.renew_payment_lease(p['id'], WORKER_ID):
+                    continue
+
+                # Already confirmed paid, but the previous delivery never finished
+                if p['paid'] == db_manager.PAYMENT_PROCESSING:
+                    process_successful_payment(p['user_id'], p['reference'])
                     continue
 
                 if p.get("poll_url"):
-                    res = pesepay.poll_transaction(p['poll_url'])
+                    res = get_pesepay().poll_transaction(p['poll_url'])
                     if res.success and res.paid:
                         process_successful_payment(p['user_id'], p['reference'])
             time.sleep(10)
         except Exception as e: print("Poll Error:", e); time.sleep(10)
 
+# -------------------------------------------------
+# MATCH NOTIFICATIONS (Background Worker)
+# -------------------------------------------------
+def notify_waiting_users():
+    """Tells AWAITING_MATCHES users about newly registered profiles that match them."""
+    phones = set()
+    handled = []
+    for event_id, new_uid in db_manager.claim_match_events():
+        # One bad profile mustn't cost the rest of the batch; failed events are retried later
+        try:
+            for w in db_manager.get_waiting_users_matching(new_uid):
+                phones.add(w['phone'])
+            handled.append(event_id)
+        except Exception as e:
+            print(f"Match Notify Error (user {new_uid}):", e)
+    if phones:
+        send_whatsapp_bulk(phones, "🔥 *New match alert!* Someone who fits what you're looking for just joined.\n\n"
+                                   "Type *STATUS* to see your matches.")
+    db_manager.delete_match_events(handled)
+
+def check_new_profiles():
+    while True:
+        try:
+            notify_waiting_users()
+        except Exception as e: print("Match Notify Error:", e)
+        time.sleep(30)
+
+def init_schema():
+    """Blocking on purpose: new code must not serve requests against an old schema."""
+    with timed("db_connect"):
+        db_manager.conn().close()
+    with timed("db_schema"):
+        db_manager.init_db()
+
+def warm_up():
+    """Creates the PesePay client (the DB connection is already open from init_schema())."""
+    try:
+        get_pesepay()
+    except Exception as e:
+        print("Warm-up Error:", e)
+    STARTUP_REPORT["total"] = round((time.perf_counter() - _BOOT_T0) * 1000, 1)
+    print("⏱️ Startup report (ms):", STARTUP_REPORT)
+
 @app.on_event("startup")
 def startup():
-    db_manager.init_db()
-    # Start the background thread for automatic payment confirmation
-    threading.Thread(target=check_pending_payments, daemon=True).start()
+    # A single version SELECT when the schema is current; DDL only after SCHEMA_VERSION changes
+    init_schema()
+    if LAZY_INIT:
+        threading.Thread(target=warm_up, daemon=True).start()
+    else:
+        warm_up()
+    if EMBEDDED_POLLER:
+        # Start the background threads for automatic payment confirmation and match alerts
+        threading.Thread(target=check_pending_payments, daemon=True).start()
+        threading.Thread(target=check_new_profiles, daemon=True).start()
+
+@app.get("/startup")
+def startup_report():
+    return JSONResponse(STARTUP_REPORT)
+
+@app.get("/metrics/db")
+def db_metrics():
+    return JSONResponse(db_manager.pool_stats())
 
 
 
@@ -154,6 +286,7 @@ def create_pesepay_payment(uid, phone, method, currency, amount):
         # EcoCash uses customerPhoneNumber, InnBucks uses innbucksNumber
         fields = {"customerPhoneNumber": clean_num} if "PZW21" in method or "PZW20" in method else {"innbucksNumber": clean_num}
         
+        pesepay = get_pesepay()
         payment = pesepay.create_payment(currency, method, "noreply@shelbydates.com", clean_num, db_manager.get_profile_name(uid))
         response = pesepay.make_seamless_payment(payment, "Shelby Fee", amount, fields)
 
@@ -229,7 +362,7 @@ def handle_message(phone: str, text: str, payload: dict) -> str:
 
         if profile.get("picture"):
             # Sends the photo with the profile text as a caption
-            send_whatsapp_image(phone, profile["picture"], caption)
+            send_whatsapp_image(phone, media_cache.photo_url(profile["picture"], profile["picture_hash"]), caption)
             return "" # Return empty string because the image function handled the reply
         
         return caption
@@ -365,6 +498,7 @@ def handle_message(phone: str, text: str, payload: dict) -> str:
     if state == "GET_PHOTO":
         if msg_l == "skip":
             db_manager.update_profile(uid, "picture", None)
+            db_manager.update_profile(uid, "picture_hash", None)
             db_manager.set_state(uid, "GET_PHONE")
             return "⏩ Photo skipped. 📞 Now, enter the phone number where matches can contact you:"
 
@@ -382,6 +516,10 @@ def handle_message(phone: str, text: str, payload: dict) -> str:
 
         if photo_link:
             db_manager.update_profile(uid, "picture", photo_link)
+            db_manager.update_profile(uid, "picture_hash", None)
+            if photo_link.startswith("http"):
+                # Download, store and upload the photo once, without holding up the reply
+                threading.Thread(target=media_cache.cache_profile_photo, args=(uid, photo_link), daemon=True).start()
             db_manager.set_state(uid, "GET_PHONE")
             return "✅ Photo received! 📞 Finally, enter the phone number where matches can contact you (e.g., 0772111222):"
         
@@ -420,6 +558,8 @@ def handle_message(phone: str, text: str, payload: dict) -> str:
             return "❗ Invalid number. Please enter a Zimbabwean number (e.g., 0772123456)."
 
         db_manager.update_profile(uid, "contact_phone", msg)
+        # Let the worker tell waiting users this new profile matches them
+        db_manager.queue_match_event(uid)
 
         # --- NEW: ALERT THE CHANNEL ---
         # Fetch the newly completed profile info
@@ -430,7 +570,7 @@ def handle_message(phone: str, text: str, payload: dict) -> str:
                 new_prof['age'], 
                 new_prof['location'], 
                 new_prof['intent'], 
-                new_prof['picture']
+                media_cache.photo_url(new_prof['picture'], new_prof['picture_hash'])
             )
         # ------------------------------
 
@@ -453,7 +593,7 @@ def handle_message(phone: str, text: str, payload: dict) -> str:
                                f"📞 *Contact:* [Locked 🔒 Pay to View]")
             
             if m.get('picture'):
-                send_whatsapp_image(phone, m['picture'], preview_caption)
+                send_whatsapp_image(phone, media_cache.photo_url(m['picture'], m.get('picture_hash')), preview_caption)
             else:
                 send_whatsapp_message(phone, preview_caption)
     
@@ -511,10 +651,14 @@ def handle_message(phone: str, text: str, payload: dict) -> str:
         if msg_l == "status":
             pending = db_manager.get_pending_payments_for_user(uid)
             if not pending: return "❌ No active payment. Type *HELLO*."
-            res = pesepay.poll_transaction(pending[0]['poll_url'])
+            # Already confirmed and being delivered: no need to ask PesePay again
+            if pending[0]['paid'] == db_manager.PAYMENT_PROCESSING:
+                return "✅ Payment already verified. Your matches are on their way!"
+            res = get_pesepay().poll_transaction(pending[0]['poll_url'])
             if res.success and res.paid:
-                process_successful_payment(uid, pending[0]['reference'])
-                return "✅ Verified! Sending matches..."
+                if process_successful_payment(uid, pending[0]['reference']):
+                    return "✅ Verified! Sending matches..."
+                return "✅ Payment already verified. Your matches are on their way!"
             return "⏳ Not paid yet. Enter PIN and type *STATUS* again."
         return "⏳ Waiting for PIN. Type *STATUS* to check."
 
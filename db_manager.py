@@ -2,36 +2,170 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
+import time
 import random
-import mysql.connector.pooling
+import threading
+import mysql.connector
 from datetime import datetime
 
+from db_pool import ConnectionPool
+
 # -------------------------------------------------
 # DB CONNECTION POOL
 # -------------------------------------------------
+# DB_POOL_SIZE: max open connections per process
+# DB_POOL_TIMEOUT: seconds a caller queues for a connection before PoolTimeout
+# DB_POOL_VALIDATE_AFTER: idle seconds after which a connection is pinged before reuse
 _pool = None
+_pool_lock = threading.Lock()
+
+def _make_pool(name, host, port):
+    return ConnectionPool(
+        name,
+        size=int(os.getenv("DB_POOL_SIZE", 10)),
+        acquire_timeout=float(os.getenv("DB_POOL_TIMEOUT", 5)),
+        validate_after=float(os.getenv("DB_POOL_VALIDATE_AFTER", 30)),
+        host=host,
+        user=os.getenv("MYSQLUSER"),
+        password=os.getenv("MYSQLPASSWORD"),
+        database=os.getenv("MYSQL_DATABASE"),
+        port=port,
+    )
 
 def conn():
     global _pool
     if not _pool:
-        _pool = mysql.connector.pooling.MySQLConnectionPool(
-            pool_name="dating_pool",
-            pool_size=10,
-            host=os.getenv("MYSQLHOST1"),
-            user=os.getenv("MYSQLUSER"),
-            password=os.getenv("MYSQLPASSWORD"),
-            database=os.getenv("MYSQL_DATABASE"),
-            port=int(os.getenv("MYSQL_PORT", 3306)),
-        )
+        # The warm-up thread and the first request can race to build the pool
+        with _pool_lock:
+            if not _pool:
+                _pool = _make_pool("dating_pool", os.getenv("MYSQLHOST1"), int(os.getenv("MYSQL_PORT", 3306)))
     return _pool.get_connection()
 
 # -------------------------------------------------
-# INIT (Drops and Creates)
+# READ REPLICA ROUTING
+# -------------------------------------------------
+# Set MYSQLHOST_REPLICA to send read_conn() queries to a replica. A user who
+# wrote in the last READ_YOUR_WRITES_WINDOW seconds reads from the primary so
+# they never see their own change missing. Pins are per process, so anything
+# that must be current across processes (the users row) never uses read_conn().
+READ_YOUR_WRITES_WINDOW = float(os.getenv("READ_YOUR_WRITES_WINDOW", 5))
+# After a replica failure, skip it for this many seconds
+REPLICA_RETRY_AFTER = 30
+
+_replica_pool = None
+_replica_down_until = 0.0
+_recent_writes = {}  # uid -> monotonic time of their last write
+
+def _replica():
+    global _replica_pool
+    host = os.getenv("MYSQLHOST_REPLICA")
+    if not _replica_pool and host:
+        with _pool_lock:
+            if not _replica_pool:
+                port = int(os.getenv("MYSQL_REPLICA_PORT", os.getenv("MYSQL_PORT", 3306)))
+                _replica_pool = _make_pool("dating_replica_pool", host, port)
+    return _replica_pool
+
+def mark_write(uid):
+    now = time.monotonic()
+    _recent_writes[uid] = now
+    if len(_recent_writes) > 10000:
+        # Drop expired pins so the dict doesn't grow with every user ever seen
+        for k, t in list(_recent_writes.items()):
+            if now - t > READ_YOUR_WRITES_WINDOW:
+                _recent_writes.pop(k, None)
+
+def is_pinned(uid):
+    t = _recent_writes.get(uid)
+    return t is not None and time.monotonic() - t < READ_YOUR_WRITES_WINDOW
+
+def read_conn(uid=None):
+    """Connection for a read-only query: the replica if configured and safe, otherwise the primary."""
+    global _replica_down_until
+    if (uid is not None and is_pinned(uid)) or time.monotonic() < _replica_down_until:
+        return conn()
+    pool = _replica()
+    if not pool:
+        return conn()
+    try:
+        return pool.get_connection()
+    except Exception as e:
+        print("Replica Error, falling back to primary:", e)
+        _replica_down_until = time.monotonic() + REPLICA_RETRY_AFTER
+        return conn()
+
+def pool_stats():
+    stats = {"primary": _pool.stats() if _pool else {}}
+    if _replica_pool:
+        stats["replica"] = _replica_pool.stats()
+    return stats
+
+# -------------------------------------------------
+# INIT (Creates missing tables)
 # -------------------------------------------------
+# Bump this whenever the DDL below changes so init_db() re-runs it on the next boot
+SCHEMA_VERSION = 7
+
+def get_schema_version(cur):
+    try:
+        cur.execute("SELECT version FROM schema_meta WHERE id = 1")
+        row = cur.fetchone()
+        return row[0] if row else 0
+    except mysql.connector.Error:
+        # First boot: schema_meta doesn't exist yet
+        return 0
+
+def add_column(cur, table, column, definition):
+    """ALTER TABLE ... ADD COLUMN that is safe to re-run (MySQL has no ADD COLUMN IF NOT EXISTS)."""
+    cur.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """, (table, column))
+    if not cur.fetchone():
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def add_index(cur, table, index, columns):
+    cur.execute("""
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    """, (table, index))
+    if not cur.fetchone():
+        cur.execute(f"CREATE INDEX {index} ON {table} ({columns})")
+
+# Every web process and the worker call init_db() at boot; only one may run the DDL
+SCHEMA_LOCK_TIMEOUT = 120
+
 def init_db():
     c = conn()
     cur = c.cursor()
 
+    if get_schema_version(cur) == SCHEMA_VERSION:
+        cur.close()
+        c.close()
+        print(f"✅ Database schema v{SCHEMA_VERSION} up to date. Skipping DDL.")
+        return
+
+    # add_column()/add_index() check-then-ALTER, so concurrent runs would hit duplicate column/index errors
+    cur.execute("SELECT GET_LOCK('schema_migration', %s)", (SCHEMA_LOCK_TIMEOUT,))
+    if cur.fetchone()[0] != 1:
+        cur.close()
+        c.close()
+        raise RuntimeError(f"Timed out after {SCHEMA_LOCK_TIMEOUT}s waiting for the schema_migration lock")
+    try:
+        # Another process may have migrated while we waited for the lock
+        if get_schema_version(cur) == SCHEMA_VERSION:
+            print(f"✅ Database schema v{SCHEMA_VERSION} applied by another process.")
+        else:
+            create_schema(cur)
+            c.commit()
+            print(f"✅ Database connection verified. Tables checked/created (schema v{SCHEMA_VERSION}).")
+    finally:
+        cur.execute("SELECT RELEASE_LOCK('schema_migration')")
+        cur.fetchone()
+        cur.close()
+        c.close()
+
+def create_schema(cur):
     # 1. Users Table (No drop, only create if missing)
     cur.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -74,17 +208,123 @@ def init_db():
             FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
         )
     """)
+    # v2: lease columns so several pollers can share the pending queue
+    add_column(cur, "payments", "claimed_by", "VARCHAR(64)")
+    add_column(cur, "payments", "claimed_until", "DATETIME")
+    add_index(cur, "payments", "idx_payments_pending", "paid, claimed_until")
+    # v6: delivery deadline for PROCESSING payments, separate from the poller lease
+    add_column(cur, "payments", "processing_until", "DATETIME")
+
+    # 4. Media cache (v3): content hash of each profile photo and its Green API upload
+    add_column(cur, "profiles", "picture_hash", "CHAR(64)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS media_files (
+            hash CHAR(64) PRIMARY KEY,
+            upload_url TEXT,
+            uploaded_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
 
-    c.commit()
-    cur.close()
-    c.close()
-    print("✅ Database connection verified. Tables checked/created.")
+    # 5. New-profile queue for the match notification sweeper (v4)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS match_events (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+    # v7: events stay queued under a lease until handled, with a retry cap
+    add_column(cur, "match_events", "claimed_until", "DATETIME")
+    add_column(cur, "match_events", "attempts", "INT DEFAULT 0")
+    add_index(cur, "users", "idx_users_chat_state", "chat_state")
+    add_index(cur, "profiles", "idx_profiles_reverse_match", "preferred_gender, intent")
+
+    # 6. Retention (v5): payment history, partitioned by year so old years can be dropped whole
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS payments_history (
+            id INT NOT NULL,
+            user_id INT,
+            reference VARCHAR(50),
+            poll_url TEXT,
+            paid TINYINT,
+            created_at DATETIME NOT NULL,
+            paid_at DATETIME,
+            archived_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, created_at),
+            KEY idx_history_user (user_id)
+        )
+        PARTITION BY RANGE (YEAR(created_at)) (
+            PARTITION p2025 VALUES LESS THAN (2026),
+            PARTITION p2026 VALUES LESS THAN (2027),
+            PARTITION p2027 VALUES LESS THAN (2028),
+            PARTITION p2028 VALUES LESS THAN (2029),
+            PARTITION pmax VALUES LESS THAN MAXVALUE
+        )
+    """)
+    add_index(cur, "payments", "idx_payments_created", "paid, created_at")
+    # Last time the profile was touched, so abandoned registrations can be found
+    add_column(cur, "profiles", "updated_at", "DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP")
+    add_index(cur, "profiles", "idx_profiles_incomplete", "contact_phone, updated_at")
+
+    # 7. Schema version marker
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_meta (
+            id TINYINT PRIMARY KEY,
+            version INT NOT NULL
+        )
+    """)
+    cur.execute("REPLACE INTO schema_meta (id, version) VALUES (1, %s)", (SCHEMA_VERSION,))
 
 # -------------------------------------------------
 # MATCHING LOGIC
 # -------------------------------------------------
+# Which candidate intents each intent can be matched with (see is_match)
+COMPATIBLE_INTENTS = {
+    "sugar mummy": ["benten"],
+    "benten": ["sugar mummy"],
+    "sugar daddy": ["girlfriend"],
+    "girlfriend": ["sugar daddy", "boyfriend"],
+    "boyfriend": ["girlfriend"],
+    "1 night stand": ["1 night stand"],
+    "just vibes": ["just vibes"],
+    "friend": ["friend"],
+}
+
+def is_match(user, cand):
+    """True if `cand` is a match for `user` (gender is filtered separately, in SQL)."""
+    u_intent = user['intent'].lower()
+    c_intent = (cand.get('intent') or "").lower()
+
+    # RULE A: Sugar Mummy + Benten
+    if (u_intent == "sugar mummy" and c_intent == "benten"):
+        return user['age'] > cand['age']
+
+    elif (u_intent == "benten" and c_intent == "sugar mummy"):
+        return cand['age'] > user['age']
+
+    # RULE B: Sugar Daddy + Girlfriend
+    elif (u_intent == "sugar daddy" and c_intent == "girlfriend"):
+        return user['age'] > cand['age']
+
+    elif (u_intent == "girlfriend" and c_intent == "sugar daddy"):
+        return cand['age'] > user['age']
+
+    # RULE C: Boyfriend + Girlfriend
+    elif (u_intent == "boyfriend" and c_intent == "girlfriend") or \
+         (u_intent == "girlfriend" and c_intent == "boyfriend"):
+        return (user['age_min'] <= cand['age'] <= user['age_max']) and \
+               (cand['age_min'] <= user['age'] <= cand['age_max'])
+
+    # RULE D: Casual/Friends
+    elif u_intent == c_intent and u_intent in ["1 night stand", "just vibes", "friend"]:
+        return (user['age_min'] <= cand['age'] <= user['age_max']) and \
+               (cand['age_min'] <= user['age'] <= cand['age_max'])
+
+    return False
+
 def get_matches(user_id):
-    c = conn()
+    c = read_conn(user_id)
     cur = c.cursor(dictionary=True)
 
     # 1. Get current user's profile
@@ -95,11 +335,12 @@ def get_matches(user_id):
         c.close()
         return []
 
-    # 2. Basic Query: Opposite gender only
+    # 2. Basic Query: Opposite gender only, finished registrations only
     cur.execute("""
         SELECT * FROM profiles 
         WHERE user_id != %s 
         AND gender = %s
+        AND contact_phone IS NOT NULL
     """, (user_id, user['preferred_gender']))
     
     candidates = cur.fetchall()
@@ -112,39 +353,7 @@ def get_matches(user_id):
     user_location = (user.get('location') or "").strip().lower()
 
     for cand in candidates:
-        u_intent = user['intent'].lower()
-        c_intent = (cand.get('intent') or "").lower()
-        
-        match_found = False
-
-        # RULE A: Sugar Mummy + Benten
-        if (u_intent == "sugar mummy" and c_intent == "benten"):
-            if user['age'] > cand['age']: match_found = True
-            
-        elif (u_intent == "benten" and c_intent == "sugar mummy"):
-            if cand['age'] > user['age']: match_found = True
-
-        # RULE B: Sugar Daddy + Girlfriend 
-        elif (u_intent == "sugar daddy" and c_intent == "girlfriend"):
-            if user['age'] > cand['age']: match_found = True
-            
-        elif (u_intent == "girlfriend" and c_intent == "sugar daddy"):
-            if cand['age'] > user['age']: match_found = True
-
-        # RULE C: Boyfriend + Girlfriend
-        elif (u_intent == "boyfriend" and c_intent == "girlfriend") or \
-             (u_intent == "girlfriend" and c_intent == "boyfriend"):
-            if (user['age_min'] <= cand['age'] <= user['age_max']) and \
-               (cand['age_min'] <= user['age'] <= cand['age_max']):
-                match_found = True
-
-        # RULE D: Casual/Friends
-        elif u_intent == c_intent and u_intent in ["1 night stand", "just vibes", "friend"]:
-            if (user['age_min'] <= cand['age'] <= user['age_max']) and \
-               (cand['age_min'] <= user['age'] <= cand['age_max']):
-                match_found = True
-
-        if match_found:
+        if is_match(user, cand):
             valid_matches.append(cand)
 
     # --- LOCATION LOGIC: Sort and Sample ---
@@ -172,8 +381,7 @@ def get_matches(user_id):
 # -------------------------------------------------
 # USER & PROFILE HELPERS
 # -------------------------------------------------
-def get_user_by_phone(phone):
-    c = conn()
+def _fetch_user_by_phone(c, phone):
     cur = c.cursor(dictionary=True)
     cur.execute("SELECT * FROM users WHERE phone=%s", (phone,))
     u = cur.fetchone()
@@ -181,20 +389,27 @@ def get_user_by_phone(phone):
     c.close()
     return u
 
+def get_user_by_phone(phone):
+    # Always the primary: chat_state drives the state machine, and its last
+    # write may have come from another web process or the worker
+    return _fetch_user_by_phone(conn(), phone)
+
 def create_new_user(phone):
     c = conn()
     cur = c.cursor()
     cur.execute("INSERT INTO users (phone, chat_state) VALUES (%s, 'NEW')", (phone,))
     c.commit()
+    mark_write(cur.lastrowid)
     cur.close()
     c.close()
-    return get_user_by_phone(phone)
+    return _fetch_user_by_phone(conn(), phone)
 
 def set_state(uid, state):
     c = conn()
     cur = c.cursor()
     cur.execute("UPDATE users SET chat_state=%s WHERE id=%s", (state, uid))
     c.commit()
+    mark_write(uid)
     cur.close()
     c.close()
 
@@ -205,6 +420,7 @@ def ensure_profile(uid):
     if not cur.fetchone():
         cur.execute("INSERT INTO profiles (user_id) VALUES (%s)", (uid,))
         c.commit()
+        mark_write(uid)
     cur.close()
     c.close()
 
@@ -214,6 +430,7 @@ def update_profile(uid, field, value):
     query = f"UPDATE profiles SET {field}=%s WHERE user_id=%s"
     cur.execute(query, (value, uid))
     c.commit()
+    mark_write(uid)
     cur.close()
     c.close()
 
@@ -224,40 +441,125 @@ def reset_profile(uid):
         UPDATE profiles SET
             gender=NULL, name=NULL, age=NULL, location=NULL, intent=NULL,
             preferred_gender=NULL, age_min=NULL, age_max=NULL, 
-            contact_phone=NULL, picture=NULL
+            contact_phone=NULL, picture=NULL, picture_hash=NULL
         WHERE user_id = %s
     """, (uid,))
     c.commit()
+    mark_write(uid)
     cur.close()
     c.close()
 
 # -------------------------------------------------
 # PAYMENT HELPERS
 # -------------------------------------------------
+# Values of payments.paid
+PAYMENT_UNPAID = 0
+PAYMENT_PAID = 1
+PAYMENT_PROCESSING = 2   # claimed by one caller, matches being delivered
+PAYMENT_EXPIRED = 3      # user never approved the prompt in time
+
+# How long a PROCESSING claim is honoured before another caller may retry delivery
+PROCESSING_TIMEOUT = 300
+
 def create_payment(uid, reference, poll_url):
     c = conn()
     cur = c.cursor()
     cur.execute("INSERT INTO payments (user_id, reference, poll_url) VALUES (%s, %s, %s)", 
                 (uid, reference, poll_url))
     c.commit()
+    mark_write(uid)
     cur.close()
     c.close()
 
+def _mark_payment_write(cur, reference):
+    cur.execute("SELECT user_id FROM payments WHERE reference = %s", (reference,))
+    row = cur.fetchone()
+    if row:
+        mark_write(row[0])
+
 def mark_payment_paid(reference):
     c = conn()
     cur = c.cursor()
     cur.execute("UPDATE payments SET paid = 1, paid_at = %s WHERE reference = %s",
                 (datetime.utcnow(), reference))
     c.commit()
+    _mark_payment_write(cur, reference)
     cur.close()
     c.close()
 
+def claim_payment(reference):
+    """
+    Atomically moves a payment from UNPAID (or a stale PROCESSING claim) to
+    PROCESSING. Returns True only for the single caller that wins the update;
+    everyone else must not deliver matches for this payment.
+
+    Only call this once PesePay has confirmed the payment. An EXPIRED payment
+    can still be claimed then, because the user was charged even if the
+    timeout sweep got to the row first.
+    """
+    c = conn()
+    cur = c.cursor()
+    cur.execute("""
+        UPDATE payments SET paid = %s, processing_until = NOW() + INTERVAL %s SECOND
+        WHERE reference = %s
+          AND (paid IN (%s, %s) OR (paid = %s AND processing_until < NOW()))
+    """, (PAYMENT_PROCESSING, PROCESSING_TIMEOUT, reference,
+          PAYMENT_UNPAID, PAYMENT_EXPIRED, PAYMENT_PROCESSING))
+    claimed = cur.rowcount == 1
+    c.commit()
+    if claimed:
+        _mark_payment_write(cur, reference)
+    cur.close()
+    c.close()
+    return claimed
+
+def expire_stale_payments(timeout_seconds, worker_id):
+    """
+    Expires every UNPAID payment older than `timeout_seconds` and sends its
+    user back to NEW, all in one transaction. Payments another worker is
+    still polling are left to that worker. Returns the phones to notify.
+    """
+    c = conn()
+    cur = c.cursor()
+    cur.execute("""
+        SELECT p.id, p.user_id, u.phone FROM payments p
+        JOIN users u ON u.id = p.user_id
+        WHERE p.paid = %s AND p.created_at < NOW() - INTERVAL %s SECOND
+          AND (p.claimed_until IS NULL OR p.claimed_until < NOW() OR p.claimed_by = %s)
+        FOR UPDATE SKIP LOCKED
+    """, (PAYMENT_UNPAID, timeout_seconds, worker_id))
+    rows = cur.fetchall()
+    if not rows:
+        c.commit()
+        cur.close()
+        c.close()
+        return []
+
+    payment_ids = [r[0] for r in rows]
+    user_ids = list({r[1] for r in rows})
+    cur.execute(f"""
+        UPDATE payments SET paid = %s
+        WHERE paid = %s AND id IN ({", ".join(["%s"] * len(payment_ids))})
+    """, (PAYMENT_EXPIRED, PAYMENT_UNPAID, *payment_ids))
+    # Leave users alone if they already moved on from the payment prompt
+    cur.execute(f"""
+        UPDATE users SET chat_state = 'NEW'
+        WHERE chat_state = 'PAYMENT_PENDING' AND id IN ({", ".join(["%s"] * len(user_ids))})
+    """, tuple(user_ids))
+    c.commit()
+    for uid in user_ids:
+        mark_write(uid)
+    cur.close()
+    c.close()
+    return list({r[2] for r in rows if r[2]})
+
 def activate_user(uid):
     c = conn()
     cur = c.cursor()
     cur.execute("UPDATE users SET is_paid=1, paid_at=%s WHERE id=%s",
                 (datetime.utcnow(), uid))
     c.commit()
+    mark_write(uid)
     cur.close()
     c.close()
 
@@ -266,18 +568,58 @@ def reset_user_payment(uid):
     cur = c.cursor()
     cur.execute("UPDATE users SET is_paid = 0 WHERE id = %s", (uid,))
     c.commit()
+    mark_write(uid)
     cur.close()
     c.close()
 
-def get_pending_payments():
+# Lease per payment: one PesePay poll (~15s) plus delivering up to 4 match cards (~15s each), with headroom
+PAYMENT_LEASE = 120
+
+def claim_pending_payments(worker_id, lease_seconds=PAYMENT_LEASE, limit=50):
+    """
+    Leases up to `limit` unpaid payments, plus any PROCESSING payment whose
+    delivery was abandoned, to this worker. Rows another worker holds are
+    skipped, and a lease that isn't renewed expires so a crashed worker's
+    payments are picked up again. Call renew_payment_lease() before handling
+    each row: a long batch can outlive the lease taken here.
+    """
     c = conn()
     cur = c.cursor(dictionary=True)
-    cur.execute("SELECT * FROM payments WHERE paid = 0")
+    cur.execute("""
+        SELECT * FROM payments
+        WHERE (paid = %s OR (paid = %s AND processing_until < NOW()))
+          AND (claimed_until IS NULL OR claimed_until < NOW() OR claimed_by = %s)
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    """, (PAYMENT_UNPAID, PAYMENT_PROCESSING, worker_id, limit))
     rows = cur.fetchall()
+    if rows:
+        ids = [r['id'] for r in rows]
+        placeholders = ", ".join(["%s"] * len(ids))
+        cur.execute(f"""
+            UPDATE payments SET claimed_by = %s, claimed_until = NOW() + INTERVAL %s SECOND
+            WHERE id IN ({placeholders})
+        """, (worker_id, lease_seconds, *ids))
+    c.commit()
     cur.close()
     c.close()
     return rows
 
+def renew_payment_lease(payment_id, worker_id, lease_seconds=PAYMENT_LEASE):
+    """Extends our lease on one payment. False means another worker has taken it over."""
+    c = conn()
+    cur = c.cursor()
+    cur.execute("""
+        UPDATE payments SET claimed_until = NOW() + INTERVAL %s SECOND
+        WHERE id = %s AND claimed_by = %s
+    """, (lease_seconds, payment_id, worker_id))
+    renewed = cur.rowcount == 1
+    c.commit()
+    cur.close()
+    c.close()
+    return renewed
+
 def get_user_phone(uid):
     c = conn()
     cur = c.cursor()
@@ -288,7 +630,7 @@ def get_user_phone(uid):
     return row[0] if row else None
 
 def get_profile_name(uid):
-    c = conn()
+    c = read_conn(uid)
     cur = c.cursor()
     cur.execute("SELECT name FROM profiles WHERE user_id = %s", (uid,))
     row = cur.fetchone()
@@ -297,19 +639,21 @@ def get_profile_name(uid):
     return row[0] if row and row[0] else "Customer"
 
 def get_pending_payments_for_user(uid):
-    c = conn()
+    """Unpaid payments plus any whose matches are being delivered right now (PROCESSING)."""
+    c = read_conn(uid)
     cur = c.cursor(dictionary=True)
-    cur.execute("SELECT * FROM payments WHERE user_id=%s AND paid=0 ORDER BY created_at DESC", (uid,))
+    cur.execute("SELECT * FROM payments WHERE user_id=%s AND paid IN (%s, %s) ORDER BY created_at DESC",
+                (uid, PAYMENT_UNPAID, PAYMENT_PROCESSING))
     rows = cur.fetchall()
     cur.close()
     c.close()
     return rows
 
 def get_profile(uid):
-    c = conn() # Using your existing conn() function
+    c = read_conn(uid)
     cur = c.cursor()
     # Explicitly naming columns to ensure we know exactly which index they are in
-    cur.execute("SELECT name, age, location, intent, contact_phone, picture FROM profiles WHERE user_id = %s", (uid,))
+    cur.execute("SELECT name, age, location, intent, contact_phone, picture, picture_hash FROM profiles WHERE user_id = %s", (uid,))
     row = cur.fetchone()
     cur.close()
     c.close()
@@ -321,6 +665,199 @@ def get_profile(uid):
             "location": row[2],
             "intent": row[3],
             "contact_phone": row[4],
-            "picture": row[5] # This is the photo URL/ID
+            "picture": row[5], # This is the photo URL/ID
+            "picture_hash": row[6] # Key into the media cache, if it was cached
         }
-    return None
\ No newline at end of file
+    return None
+
+# -------------------------------------------------
+# MEDIA CACHE HELPERS
+# -------------------------------------------------
+def get_media_upload(h):
+    c = conn()
+    cur = c.cursor(dictionary=True)
+    cur.execute("""
+        SELECT upload_url, TIMESTAMPDIFF(SECOND, uploaded_at, NOW()) AS age
+        FROM media_files WHERE hash = %s
+    """, (h,))
+    row = cur.fetchone()
+    cur.close()
+    c.close()
+    return row
+
+def save_media_upload(h, upload_url):
+    c = conn()
+    cur = c.cursor()
+    cur.execute("""
+        INSERT INTO media_files (hash, upload_url, uploaded_at) VALUES (%s, %s, NOW())
+        ON DUPLICATE KEY UPDATE upload_url = VALUES(upload_url), uploaded_at = NOW()
+    """, (h, upload_url))
+    c.commit()
+    cur.close()
+    c.close()
+
+# -------------------------------------------------
+# MATCH NOTIFICATIONS
+# -------------------------------------------------
+def queue_match_event(uid):
+    """Records a freshly completed profile for the notification sweeper."""
+    c = conn()
+    cur = c.cursor()
+    cur.execute("INSERT INTO match_events (user_id) VALUES (%s)", (uid,))
+    c.commit()
+    cur.close()
+    c.close()
+
+# Seconds a worker has to handle a claimed event before it is retried
+MATCH_EVENT_LEASE = 300
+# Give up on an event (e.g. a profile that keeps failing) after this many claims
+MATCH_EVENT_MAX_ATTEMPTS = 5
+
+def claim_match_events(limit=100):
+    """
+    Leases a batch of queued signups as [(event_id, user_id)]; concurrent
+    workers get disjoint batches. Events stay queued until delete_match_events()
+    so a failure retries them once the lease runs out.
+    """
+    c = conn()
+    cur = c.cursor()
+    cur.execute("""
+        SELECT id, user_id FROM match_events
+        WHERE (claimed_until IS NULL OR claimed_until < NOW()) AND attempts < %s
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    """, (MATCH_EVENT_MAX_ATTEMPTS, limit))
+    rows = cur.fetchall()
+    if rows:
+        cur.execute(f"""
+            UPDATE match_events SET claimed_until = NOW() + INTERVAL %s SECOND, attempts = attempts + 1
+            WHERE id IN ({", ".join(["%s"] * len(rows))})
+        """, (MATCH_EVENT_LEASE, *[r[0] for r in rows]))
+    c.commit()
+    cur.close()
+    c.close()
+    return rows
+
+def delete_match_events(ids):
+    if not ids:
+        return
+    c = conn()
+    cur = c.cursor()
+    cur.execute(f"DELETE FROM match_events WHERE id IN ({', '.join(['%s'] * len(ids))})", tuple(ids))
+    c.commit()
+    cur.close()
+    c.close()
+
+def delete_dead_match_events_batch(limit=500):
+    """Removes one batch of events that hit MATCH_EVENT_MAX_ATTEMPTS and will never be retried."""
+    c = conn()
+    cur = c.cursor()
+    cur.execute("""
+        DELETE FROM match_events
+        WHERE attempts >= %s AND claimed_until < NOW()
+        ORDER BY id
+        LIMIT %s
+    """, (MATCH_EVENT_MAX_ATTEMPTS, limit))
+    n = cur.rowcount
+    c.commit()
+    cur.close()
+    c.close()
+    return n
+
+def get_waiting_users_matching(new_uid):
+    """
+    Reverse match: the AWAITING_MATCHES users for whom the new profile would
+    show up in get_matches(). Only users with a compatible gender and intent
+    are loaded, instead of re-running get_matches() for every waiting user.
+    """
+    c = read_conn()
+    cur = c.cursor(dictionary=True)
+    cur.execute("SELECT * FROM profiles WHERE user_id=%s", (new_uid,))
+    new_prof = cur.fetchone()
+    intent = ((new_prof or {}).get('intent') or "").lower()
+    if not new_prof or new_prof.get('age') is None or not intent:
+        cur.close()
+        c.close()
+        return []
+
+    waiting_intents = [w for w, cands in COMPATIBLE_INTENTS.items() if intent in cands]
+    cur.execute(f"""
+        SELECT p.*, u.phone FROM profiles p
+        JOIN users u ON u.id = p.user_id
+        WHERE u.chat_state = 'AWAITING_MATCHES'
+          AND p.user_id != %s
+          AND p.preferred_gender = %s
+          AND p.intent IN ({", ".join(["%s"] * len(waiting_intents))})
+          AND p.contact_phone IS NOT NULL
+          AND p.age IS NOT NULL AND p.age_min IS NOT NULL AND p.age_max IS NOT NULL
+    """, (new_uid, new_prof['gender'], *waiting_intents))
+    waiting = cur.fetchall()
+    cur.close()
+    c.close()
+
+    return [w for w in waiting if is_match(w, new_prof)]
+
+# -------------------------------------------------
+# RETENTION HELPERS
+# -------------------------------------------------
+# Each batch first picks candidates with a plain (non-locking) read served by
+# idx_payments_created / idx_profiles_incomplete, then locks only those rows by
+# primary key, re-checking the predicate, in one short transaction. Scanning
+# with FOR UPDATE instead would lock every row the scan walks past, including
+# active users' profiles and payments.
+def _lock_ids(cur, table, key, ids, predicate, params):
+    """Locks the given primary keys that still match `predicate`; returns them."""
+    cur.execute(f"""
+        SELECT {key} FROM {table}
+        WHERE {key} IN ({", ".join(["%s"] * len(ids))}) AND {predicate}
+        FOR UPDATE SKIP LOCKED
+    """, (*ids, *params))
+    return [r[0] for r in cur.fetchall()]
+
+def archive_payments_batch(older_than_days, limit=500):
+    """Moves one batch of settled (PAID/EXPIRED) payments into payments_history. Returns rows moved."""
+    predicate = "paid IN (%s, %s) AND created_at < NOW() - INTERVAL %s DAY"
+    params = (PAYMENT_PAID, PAYMENT_EXPIRED, older_than_days)
+
+    c = conn()
+    cur = c.cursor()
+    cur.execute(f"SELECT id FROM payments WHERE {predicate} ORDER BY created_at LIMIT %s", (*params, limit))
+    ids = [r[0] for r in cur.fetchall()]
+    if ids:
+        ids = _lock_ids(cur, "payments", "id", ids, predicate, params)
+    if ids:
+        placeholders = ", ".join(["%s"] * len(ids))
+        cur.execute(f"""
+            INSERT IGNORE INTO payments_history (id, user_id, reference, poll_url, paid, created_at, paid_at)
+            SELECT id, user_id, reference, poll_url, paid, created_at, paid_at
+            FROM payments WHERE id IN ({placeholders})
+        """, tuple(ids))
+        cur.execute(f"DELETE FROM payments WHERE id IN ({placeholders})", tuple(ids))
+    c.commit()
+    cur.close()
+    c.close()
+    return len(ids)
+
+def prune_incomplete_profiles_batch(older_than_days, limit=500):
+    """
+    Deletes one batch of registrations abandoned before GET_PHONE and sends
+    their users back to NEW. ensure_profile() recreates the row if they return.
+    """
+    predicate = "contact_phone IS NULL AND updated_at < NOW() - INTERVAL %s DAY"
+    params = (older_than_days,)
+
+    c = conn()
+    cur = c.cursor()
+    cur.execute(f"SELECT user_id FROM profiles WHERE {predicate} ORDER BY updated_at LIMIT %s", (*params, limit))
+    ids = [r[0] for r in cur.fetchall()]
+    if ids:
+        ids = _lock_ids(cur, "profiles", "user_id", ids, predicate, params)
+    if ids:
+        placeholders = ", ".join(["%s"] * len(ids))
+        cur.execute(f"DELETE FROM profiles WHERE user_id IN ({placeholders})", tuple(ids))
+        cur.execute(f"UPDATE users SET chat_state = 'NEW' WHERE id IN ({placeholders})", tuple(ids))
+    c.commit()
+    cur.close()
+    c.close()
+    return len(ids)
@@ -0,0 +1,202 @@
+"""
+MySQL connection pool with a blocking, first-come-first-served acquire.
+
+mysql.connector's own pool raises PoolError the moment it runs dry, which
+turns any burst of webhooks into failed messages. This pool makes callers
+queue instead (up to a timeout), re-validates connections that sat idle,
+and keeps wait-time / exhaustion counters so the size can be tuned from data.
+"""
+import time
+import threading
+from collections import deque
+import mysql.connector
+from mysql.connector.errors import PoolError
+
+# Upper bounds (ms) of the wait-time histogram buckets
+WAIT_BUCKETS_MS = [1, 5, 10, 50, 100, 500, 1000, 5000]
+
+# Handed to a waiter when a connection was discarded: "you may open a new one"
+_NEW = object()
+
+
+class PoolTimeout(PoolError):
+    pass
+
+
+class _Waiter:
+    def __init__(self):
+        self.event = threading.Event()
+        self.cnx = None
+
+
+class PooledConnection:
+    """Proxy around a raw connection; close() hands it back to the pool."""
+
+    def __init__(self, pool, cnx):
+        self._pool = pool
+        self._cnx = cnx
+
+    def __getattr__(self, name):
+        return getattr(self._cnx, name)
+
+    def close(self):
+        if self._cnx is not None:
+            self._pool._release(self._cnx)
+            self._cnx = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ConnectionPool:
+    def __init__(self, name, size=10, acquire_timeout=5.0, validate_after=30.0, **connect_args):
+        self.name = name
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self.validate_after = validate_after
+        self._connect_args = connect_args
+
+        self._lock = threading.Lock()
+        self._idle = []            # [(cnx, released_at)], used as a stack so warm connections are reused
+        self._waiters = deque()    # FIFO of _Waiter
+        self._opened = 0           # connections currently open (idle + in use)
+
+        self._stats = {
+            "acquired": 0,
+            "waited": 0,           # acquisitions that found the pool exhausted
+            "timeouts": 0,
+            "revalidated": 0,
+            "discarded": 0,
+            "wait_ms_total": 0.0,
+            "wait_ms_max": 0.0,
+        }
+        self._histogram = [0] * (len(WAIT_BUCKETS_MS) + 1)
+
+    # -------------------------------------------------
+    # ACQUIRE / RELEASE
+    # -------------------------------------------------
+    def get_connection(self):
+        t0 = time.monotonic()
+        waiter = None
+        cnx = None
+        with self._lock:
+            # Never jump the queue: if anyone is waiting, get in line behind them
+            if self._idle and not self._waiters:
+                cnx, released_at = self._idle.pop()
+            elif self._opened < self.size and not self._waiters:
+                self._opened += 1
+                cnx = _NEW
+            else:
+                waiter = _Waiter()
+                self._waiters.append(waiter)
+                self._stats["waited"] += 1
+
+        if waiter:
+            waiter.event.wait(self.acquire_timeout)
+            with self._lock:
+                # A release may have handed us a connection right as we timed out
+                if waiter.cnx is None:
+                    self._waiters.remove(waiter)
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"{self.name}: no connection available after {self.acquire_timeout}s "
+                                      f"(size={self.size})")
+            cnx, released_at = waiter.cnx
+
+        try:
+            if cnx is _NEW:
+                cnx = self._open()
+            elif time.monotonic() - released_at > self.validate_after:
+                cnx = self._validate(cnx)
+        except Exception:
+            self._discard(None)
+            raise
+
+        self._record_wait((time.monotonic() - t0) * 1000)
+        return PooledConnection(self, cnx)
+
+    def _release(self, cnx):
+        try:
+            if cnx.in_transaction:
+                cnx.rollback()
+            healthy = cnx.is_connected()
+        except Exception:
+            healthy = False
+
+        if not healthy:
+            self._discard(cnx)
+            return
+
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.cnx = (cnx, time.monotonic())
+                waiter.event.set()
+            else:
+                self._idle.append((cnx, time.monotonic()))
+
+    def _discard(self, cnx):
+        if cnx is not None:
+            try:
+                cnx.close()
+            except Exception:
+                pass
+        with self._lock:
+            self._stats["discarded"] += 1
+            if self._waiters:
+                # Pass the freed slot straight to the next waiter
+                waiter = self._waiters.popleft()
+                waiter.cnx = (_NEW, None)
+                waiter.event.set()
+            else:
+                self._opened -= 1
+
+    # -------------------------------------------------
+    # CONNECTIONS
+    # -------------------------------------------------
+    def _open(self):
+        return mysql.connector.connect(**self._connect_args)
+
+    def _validate(self, cnx):
+        """Pings a connection that sat idle; reopens it if the server dropped it."""
+        with self._lock:
+            self._stats["revalidated"] += 1
+        try:
+            cnx.ping(reconnect=True, attempts=1)
+            return cnx
+        except Exception:
+            try:
+                cnx.close()
+            except Exception:
+                pass
+            return self._open()
+
+    # -------------------------------------------------
+    # METRICS
+    # -------------------------------------------------
+    def _record_wait(self, ms):
+        i = 0
+        while i < len(WAIT_BUCKETS_MS) and ms > WAIT_BUCKETS_MS[i]:
+            i += 1
+        with self._lock:
+            self._stats["acquired"] += 1
+            self._stats["wait_ms_total"] += ms
+            self._stats["wait_ms_max"] = max(self._stats["wait_ms_max"], ms)
+            self._histogram[i] += 1
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s["size"] = self.size
+            s["open"] = self._opened
+            s["idle"] = len(self._idle)
+            s["in_use"] = self._opened - len(self._idle)
+            s["queued"] = len(self._waiters)
+            labels = [f"<={b}ms" for b in WAIT_BUCKETS_MS] + [f">{WAIT_BUCKETS_MS[-1]}ms"]
+            s["wait_histogram"] = dict(zip(labels, self._histogram))
+        s["wait_ms_avg"] = round(s["wait_ms_total"] / s["acquired"], 2) if s["acquired"] else 0.0
+        s["wait_ms_total"] = round(s["wait_ms_total"], 1)
+        s["wait_ms_max"] = round(s["wait_ms_max"], 1)
+        return s
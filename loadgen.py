@@ -0,0 +1,301 @@
+"""
+Synthetic profile generator + get_matches micro-benchmark.
+
+Usage:
+    python loadgen.py seed 10000            # add 10k fake users/profiles
+    python loadgen.py seed 100000 --load-data
+    python loadgen.py bench --sizes 10000,100000,1000000
+    python loadgen.py purge                 # remove every seeded row
+
+Only runs against a dedicated database: set LOADGEN_MYSQLHOST (and optionally
+LOADGEN_MYSQL_DATABASE / LOADGEN_MYSQL_PORT) to somewhere other than the app's
+MYSQLHOST1/MYSQL_DATABASE. Seeded users get a phone of the form 'seed<n>' and a
+contact number starting with 000, which is_valid_zim_phone() never accepts, so
+no seeded row can pass for a real person.
+"""
+from dotenv import load_dotenv
+load_dotenv()
+
+import os
+import csv
+import time
+import random
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+import mysql.connector
+
+import db_manager
+from app import INTENT_MAP, AGE_MAP, MALE_OPTIONS, FEMALE_OPTIONS
+
+SEED_PREFIX = "seed"
+BATCH_SIZE = 5000
+
+# -------------------------------------------------
+# TARGET DATABASE
+# -------------------------------------------------
+def use_loadgen_db():
+    """Points db_manager at the loadgen database, refusing to touch the app's own."""
+    host = os.getenv("LOADGEN_MYSQLHOST")
+    database = os.getenv("LOADGEN_MYSQL_DATABASE", os.getenv("MYSQL_DATABASE"))
+    if not host:
+        raise SystemExit("❌ LOADGEN_MYSQLHOST is not set. loadgen only runs against a dedicated database.")
+    if (host, database) == (os.getenv("MYSQLHOST1"), os.getenv("MYSQL_DATABASE")):
+        raise SystemExit("❌ LOADGEN_MYSQLHOST/LOADGEN_MYSQL_DATABASE point at the app database. Refusing to seed it.")
+
+    # db_manager reads these lazily when it builds its pool
+    os.environ["MYSQLHOST1"] = host
+    os.environ["MYSQL_DATABASE"] = database
+    os.environ["MYSQL_PORT"] = os.getenv("LOADGEN_MYSQL_PORT", os.getenv("MYSQL_PORT", "3306"))
+    # Never read from the production replica either
+    os.environ.pop("MYSQLHOST_REPLICA", None)
+
+# -------------------------------------------------
+# DISTRIBUTIONS
+# -------------------------------------------------
+LOCATIONS = {
+    "Harare": ["CBD", "Budiriro", "Borrowdale", "Mbare", "Avondale", "Glen View",
+               "Highfield", "Warren Park", "Kuwadzana", "Ruwa", "Chitungwiza", "Mabvuku"],
+    "Bulawayo": ["CBD", "Nkulumane", "Entumbane", "Pumula", "Suburbs", "Hillside", "Cowdray Park"],
+    "Mutare": ["Sakubva", "Dangamvura", "Chikanga", "Murambi"],
+    "Gweru": ["Mkoba", "Senga", "Mambo", "Ascot"],
+    "Masvingo": ["Mucheke", "Rujeko", "Runyararo"],
+    "Kwekwe": ["Mbizo", "Amaveni"],
+    "Chinhoyi": ["Chikonohono", "Gadzema"],
+    "Victoria Falls": ["Chinotimba", "Mkhosana"],
+}
+# Harare and Bulawayo carry most of the traffic
+CITY_WEIGHTS = [45, 20, 8, 8, 6, 5, 4, 4]
+
+MALE_NAMES = ["Tatenda", "Tinashe", "Farai", "Tafadzwa", "Kudakwashe", "Blessing",
+              "Takudzwa", "Munyaradzi", "Simba", "Tendai", "Sipho", "Themba"]
+FEMALE_NAMES = ["Rutendo", "Chipo", "Nyasha", "Rumbidzai", "Tariro", "Vimbai",
+                "Chiedza", "Ruvimbo", "Nokuthula", "Thandiwe", "Precious", "Fadzai"]
+
+PICTURE_URL = "https://example.com/seed/profile.jpg"
+PICTURE_RATE = 0.7
+
+
+def _intent_keys(gender):
+    options = MALE_OPTIONS if gender == "male" else FEMALE_OPTIONS
+    # Only keep options that actually exist in INTENT_MAP
+    return [o for o in options if o in INTENT_MAP]
+
+
+def _age():
+    # Registrations skew young: most users are in their 20s and 30s
+    return min(80, max(18, int(random.gauss(29, 8))))
+
+
+def _phone():
+    # 000 prefix: looks like a number but can never be a real subscriber
+    return f"000{random.randint(0, 9999999):07d}"
+
+
+def fake_profile(uid):
+    gender = random.choice(["male", "female"])
+    city = random.choices(list(LOCATIONS), weights=CITY_WEIGHTS)[0]
+    age_min, age_max = AGE_MAP[random.choice(list(AGE_MAP))]
+    names = MALE_NAMES if gender == "male" else FEMALE_NAMES
+    return (
+        uid,
+        gender,
+        random.choice(names),
+        _age(),
+        f"{city}, {random.choice(LOCATIONS[city])}",
+        INTENT_MAP[random.choice(_intent_keys(gender))],
+        "female" if gender == "male" else "male",
+        age_min,
+        age_max,
+        _phone(),
+        PICTURE_URL if random.random() < PICTURE_RATE else None,
+    )
+
+# -------------------------------------------------
+# BULK INSERT
+# -------------------------------------------------
+PROFILE_COLUMNS = ("user_id, gender, name, age, location, intent, preferred_gender, "
+                   "age_min, age_max, contact_phone, picture")
+
+
+def _next_seed_number(cur):
+    cur.execute("SELECT COALESCE(MAX(CAST(SUBSTRING(phone, %s) AS UNSIGNED)), 0) + 1 "
+                "FROM users WHERE phone LIKE %s", (len(SEED_PREFIX) + 1, f"{SEED_PREFIX}%"))
+    return cur.fetchone()[0]
+
+
+def _user_ids(cur, phones):
+    # AUTO_INCREMENT assigns the ids; read them back by the (unique) phone
+    cur.execute(f"SELECT phone, id FROM users WHERE phone IN ({', '.join(['%s'] * len(phones))})",
+                tuple(phones))
+    return dict(cur.fetchall())
+
+
+def _insert_users(cur, phones):
+    # executemany() on a plain INSERT ... VALUES is rewritten into one multi-row INSERT
+    cur.executemany("INSERT INTO users (phone, chat_state) VALUES (%s, 'NEW')", [(p,) for p in phones])
+
+
+def _insert_profiles(cur, profiles):
+    cur.executemany(f"INSERT INTO profiles ({PROFILE_COLUMNS}) "
+                    f"VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", profiles)
+
+
+def _load_data_conn():
+    # LOAD DATA LOCAL needs allow_local_infile, which the shared pool doesn't enable
+    return mysql.connector.connect(
+        host=os.getenv("MYSQLHOST1"),
+        user=os.getenv("MYSQLUSER"),
+        password=os.getenv("MYSQLPASSWORD"),
+        database=os.getenv("MYSQL_DATABASE"),
+        port=int(os.getenv("MYSQL_PORT", 3306)),
+        allow_local_infile=True,
+    )
+
+
+def _load_csv(cur, rows, table, columns, extra=""):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"{table}.csv")
+        with open(path, "w", newline="") as f:
+            # \N is how LOAD DATA spells NULL
+            csv.writer(f).writerows(["\\N" if v is None else v for v in row] for row in rows)
+        cur.execute(f"LOAD DATA LOCAL INFILE '{path}' INTO TABLE {table} "
+                    "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+                    f"LINES TERMINATED BY '\\r\\n' ({columns}) {extra}")
+
+
+def _load_users(cur, phones):
+    _load_csv(cur, [(p,) for p in phones], "users", "phone", "SET chat_state='NEW'")
+
+
+def _load_profiles(cur, profiles):
+    _load_csv(cur, profiles, "profiles", PROFILE_COLUMNS)
+
+
+def seed(count, load_data=False):
+    db_manager.init_db()
+    c = _load_data_conn() if load_data else db_manager.conn()
+    cur = c.cursor()
+    first = _next_seed_number(cur)
+    insert_users, insert_profiles = (_load_users, _load_profiles) if load_data else (_insert_users, _insert_profiles)
+
+    t0 = time.perf_counter()
+    done = 0
+    while done < count:
+        n = min(BATCH_SIZE, count - done)
+        phones = [f"{SEED_PREFIX}{first + done + i}" for i in range(n)]
+        insert_users(cur, phones)
+        ids = _user_ids(cur, phones)
+        insert_profiles(cur, [fake_profile(ids[p]) for p in phones])
+        c.commit()
+        done += n
+        print(f"  seeded {done}/{count}")
+
+    cur.close()
+    c.close()
+    elapsed = time.perf_counter() - t0
+    print(f"✅ Seeded {count} profiles in {elapsed:.1f}s ({count / elapsed:.0f} rows/s)")
+
+
+def seeded_count():
+    c = db_manager.conn()
+    cur = c.cursor()
+    cur.execute("SELECT COUNT(*) FROM users WHERE phone LIKE %s", (f"{SEED_PREFIX}%",))
+    n = cur.fetchone()[0]
+    cur.close()
+    c.close()
+    return n
+
+
+def purge():
+    c = db_manager.conn()
+    cur = c.cursor()
+    # Profiles and payments go with the user through ON DELETE CASCADE
+    while True:
+        cur.execute("DELETE FROM users WHERE phone LIKE %s LIMIT %s", (f"{SEED_PREFIX}%", BATCH_SIZE))
+        c.commit()
+        if cur.rowcount < BATCH_SIZE:
+            break
+    cur.close()
+    c.close()
+    print("🧹 Seeded rows removed.")
+
+# -------------------------------------------------
+# BENCHMARK
+# -------------------------------------------------
+def _sample_user_ids(n):
+    c = db_manager.conn()
+    cur = c.cursor()
+    cur.execute("SELECT id FROM users WHERE phone LIKE %s ORDER BY RAND() LIMIT %s",
+                (f"{SEED_PREFIX}%", n))
+    ids = [r[0] for r in cur.fetchall()]
+    cur.close()
+    c.close()
+    return ids
+
+
+def bench_matches(samples=50):
+    """Times get_matches() for random seeded users and tracks peak Python memory."""
+    uids = _sample_user_ids(samples)
+    latencies = []
+    for uid in uids:
+        t0 = time.perf_counter()
+        db_manager.get_matches(uid)
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    # Separate pass: tracemalloc slows allocations down and would skew the timings
+    peaks = []
+    for uid in uids[:5]:
+        tracemalloc.start()
+        db_manager.get_matches(uid)
+        peaks.append(tracemalloc.get_traced_memory()[1] / 1024 / 1024)
+        tracemalloc.stop()
+
+    if not latencies:
+        return None
+    latencies.sort()
+    return {
+        "samples": len(latencies),
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] if len(latencies) >= 20 else latencies[-1],
+        "max_ms": latencies[-1],
+        "peak_mb": max(peaks),
+    }
+
+
+def bench(sizes, samples=50, load_data=False):
+    print(f"{'profiles':>10} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'peak MB':>9}")
+    for size in sorted(sizes):
+        missing = size - seeded_count()
+        if missing > 0:
+            seed(missing, load_data=load_data)
+        r = bench_matches(samples)
+        if r:
+            print(f"{size:>10} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} "
+                  f"{r['max_ms']:>9.1f} {r['peak_mb']:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_seed = sub.add_parser("seed", help="insert synthetic users and profiles")
+    p_seed.add_argument("count", type=int)
+    p_seed.add_argument("--load-data", action="store_true", help="use LOAD DATA LOCAL INFILE")
+
+    p_bench = sub.add_parser("bench", help="grow the table and time get_matches at each size")
+    p_bench.add_argument("--sizes", default="10000,100000,1000000")
+    p_bench.add_argument("--samples", type=int, default=50)
+    p_bench.add_argument("--load-data", action="store_true")
+
+    sub.add_parser("purge", help="delete all seeded rows")
+
+    args = parser.parse_args()
+    use_loadgen_db()
+    if args.cmd == "seed":
+        seed(args.count, load_data=args.load_data)
+    elif args.cmd == "bench":
+        bench([int(s) for s in args.sizes.split(",")], args.samples, args.load_data)
+    else:
+        purge()
@@ -0,0 +1,177 @@
+"""
+Profile photo cache.
+
+Each photo is downloaded once when the user sends it (GET_PHOTO), stored on
+disk under its SHA-256 and uploaded to Green API's file storage. Match cards
+then send the uploaded copy, so Green API doesn't re-fetch the original for
+every recipient and we stop depending on the incoming downloadUrl staying
+alive. The disk copy is LRU-bounded and only used to re-upload as the
+uploaded copy ages out.
+
+Re-uploads never happen on the send path: photo_url() returns at once and
+refreshes in a background thread. Only the process holding the disk copy
+can refresh, which is the web dyno that received the photo. Dyno disks are
+also ephemeral. Cards sent from the worker (paid matches) therefore rely on
+a web process having refreshed the upload; if none has, they fall back to
+the original link.
+"""
+import os
+import time
+import hashlib
+import threading
+import requests
+
+import db_manager
+
+CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", "media_cache")
+CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_MB", 200)) * 1024 * 1024
+# Green API only keeps uploaded files for a while; re-upload well before that
+UPLOAD_TTL = int(os.getenv("MEDIA_UPLOAD_TTL", 7 * 24 * 3600))
+
+GREEN_API_MEDIA_URL = os.getenv("GREEN_API_MEDIA_URL", "https://media.greenapi.com")
+ID_INSTANCE = os.getenv("ID_INSTANCE")
+API_TOKEN_INSTANCE = os.getenv("API_TOKEN_INSTANCE")
+
+# Start refreshing an upload this long before it expires
+REFRESH_AHEAD = UPLOAD_TTL // 5
+
+# hash -> (upload_url, expires_at), saves a DB round trip per match card
+_uploads = {}
+# hashes with a background re-upload in flight
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+# -------------------------------------------------
+# LOCAL STORE (content-addressed, LRU by mtime)
+# -------------------------------------------------
+def _path(h):
+    return os.path.join(CACHE_DIR, f"{h}.jpg")
+
+def _evict():
+    files = []
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith(".jpg"):
+            continue
+        st = os.stat(os.path.join(CACHE_DIR, name))
+        files.append((st.st_mtime, st.st_size, name))
+
+    total = sum(f[1] for f in files)
+    for _, size, name in sorted(files):
+        if total <= CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(os.path.join(CACHE_DIR, name))
+            total -= size
+        except FileNotFoundError:
+            pass
+
+def store(data):
+    h = hashlib.sha256(data).hexdigest()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    p = _path(h)
+    if os.path.exists(p):
+        os.utime(p)
+        return h
+
+    tmp = f"{p}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, p)
+    _evict()
+    return h
+
+def _read(h):
+    p = _path(h)
+    try:
+        with open(p, "rb") as f:
+            data = f.read()
+        os.utime(p)  # mark as recently used
+        return data
+    except FileNotFoundError:
+        return None
+
+# -------------------------------------------------
+# GREEN API UPLOADS
+# -------------------------------------------------
+def _upload(h, data):
+    url = f"{GREEN_API_MEDIA_URL}/waInstance{ID_INSTANCE}/uploadFile/{API_TOKEN_INSTANCE}"
+    r = requests.post(url, data=data,
+                      headers={"Content-Type": "image/jpeg", "GA-Filename": f"{h}.jpg"},
+                      timeout=30)
+    r.raise_for_status()
+    file_url = r.json().get("urlFile")
+    if file_url:
+        db_manager.save_media_upload(h, file_url)
+        _uploads[h] = (file_url, time.time() + UPLOAD_TTL)
+    return file_url
+
+def _upload_entry(h):
+    """(upload_url, expires_at) for a hash, or None if it was never uploaded."""
+    cached = _uploads.get(h)
+    if not cached:
+        row = db_manager.get_media_upload(h)
+        if not row:
+            return None
+        cached = (row['upload_url'], time.time() + UPLOAD_TTL - row['age'])
+        _uploads[h] = cached
+    return cached
+
+def _fresh_upload(h):
+    cached = _upload_entry(h)
+    if cached and time.time() < cached[1]:
+        return cached[0]
+    return None
+
+def _reupload(h):
+    try:
+        data = _read(h)
+        if data:
+            _upload(h, data)
+    except Exception as e:
+        print("Media Re-upload Error:", e)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(h)
+
+def _schedule_reupload(h):
+    # Nothing to upload from unless this process holds the disk copy
+    if not os.path.exists(_path(h)):
+        return
+    with _refreshing_lock:
+        if h in _refreshing:
+            return
+        _refreshing.add(h)
+    threading.Thread(target=_reupload, args=(h,), daemon=True).start()
+
+# -------------------------------------------------
+# PUBLIC API
+# -------------------------------------------------
+def cache_profile_photo(uid, source_url):
+    """Fetches a new profile photo once, stores it and links it to the profile. Run off the request path."""
+    try:
+        r = requests.get(source_url, timeout=30)
+        r.raise_for_status()
+        h = store(r.content)
+        db_manager.update_profile(uid, "picture_hash", h)
+        if not _fresh_upload(h):
+            _upload(h, r.content)
+    except Exception as e:
+        print("Media Cache Error:", e)
+
+def photo_url(picture, picture_hash):
+    """
+    What to send for a profile photo: the uploaded copy if still fresh, else
+    the original link. Never blocks on an upload; refreshes happen in the background.
+    """
+    if not picture_hash:
+        return picture
+
+    cached = _upload_entry(picture_hash)
+    now = time.time()
+    if cached and now < cached[1]:
+        if now > cached[1] - REFRESH_AHEAD:
+            _schedule_reupload(picture_hash)
+        return cached[0]
+
+    _schedule_reupload(picture_hash)
+    return picture
@@ -0,0 +1,56 @@
+"""
+Data retention for the tables the poller and matcher scan.
+
+- Settled payments (PAID or EXPIRED) older than PAYMENT_RETENTION_DAYS are
+  moved to payments_history, which is partitioned by year.
+- Profiles that never finished registration (no contact_phone) and haven't
+  been touched for PROFILE_RETENTION_DAYS are deleted. get_matches() already
+  skips incomplete profiles.
+- Match notification events that failed MATCH_EVENT_MAX_ATTEMPTS times are
+  deleted; the sweeper never retries them.
+
+Work is done in small batches with a pause in between so the hot tables are
+never locked for long. Runs hourly inside worker.py, or once with
+`python retention.py` (e.g. from a scheduler).
+"""
+import os
+import time
+
+import db_manager
+
+PAYMENT_RETENTION_DAYS = int(os.getenv("PAYMENT_RETENTION_DAYS", 30))
+PROFILE_RETENTION_DAYS = int(os.getenv("PROFILE_RETENTION_DAYS", 14))
+BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", 500))
+BATCH_PAUSE = 0.2  # seconds between batches, lets other transactions through
+RUN_EVERY = 3600
+
+
+def _drain(batch_fn, *args):
+    total = 0
+    while True:
+        n = batch_fn(*args, BATCH_SIZE)
+        total += n
+        if n < BATCH_SIZE:
+            return total
+        time.sleep(BATCH_PAUSE)
+
+
+def run_once():
+    archived = _drain(db_manager.archive_payments_batch, PAYMENT_RETENTION_DAYS)
+    pruned = _drain(db_manager.prune_incomplete_profiles_batch, PROFILE_RETENTION_DAYS)
+    dead_events = _drain(db_manager.delete_dead_match_events_batch)
+    print(f"🗄️ Retention: archived {archived} payments, pruned {pruned} incomplete profiles, "
+          f"dropped {dead_events} dead match events")
+    return archived, pruned, dead_events
+
+
+def check_retention():
+    while True:
+        try:
+            run_once()
+        except Exception as e: print("Retention Error:", e)
+        time.sleep(RUN_EVERY)
+
+
+if __name__ == "__main__":
+    run_once()
@@ -0,0 +1,22 @@
+"""
+Background worker: polls PesePay for pending payments and delivers matches,
+alerts waiting users about new matching signups and runs data retention,
+outside the web process.
+Started by the `worker:` line in the Procfile.
+
+Several workers can run at once; each one leases its own batch of payments
+and signups (see db_manager.claim_pending_payments / claim_match_events),
+so nothing is processed twice.
+"""
+import threading
+
+import app
+import retention
+
+if __name__ == "__main__":
+    print(f"👷 Payment worker {app.WORKER_ID} starting")
+    app.init_schema()
+    app.warm_up()
+    threading.Thread(target=app.check_new_profiles, daemon=True).start()
+    threading.Thread(target=retention.check_retention, daemon=True).start()
+    app.check_pending_payments()